@@ -1,16 +1,20 @@
 # your_project_name/agents/email_agent.py
 
 import json
-import email
-from email.header import decode_header
+from email import policy
+from email.parser import BytesParser
 from typing import Dict, Any, Optional
 import re
 
 from ..core import shared_memory
 from ..core import llm_client
+from ..core import llm_cache
 
 # --- LLM Prompt for Email Extraction ---
-EMAIL_EXTRACTION_PROMPT = """
+# Static instructions are sent as Gemini's system instruction and only the email
+# content goes in the per-request prompt, so the shared prefix stays identical
+# across requests and is eligible for implicit context caching.
+EMAIL_EXTRACTION_SYSTEM_INSTRUCTION = """
 You are an expert AI assistant specializing in extracting structured information from email communications.
 Your goal is to accurately identify and extract the following fields from the provided email content.
 Respond ONLY with a JSON object.
@@ -20,15 +24,54 @@ Fields to extract:
 - urgency: Categorize the email's urgency as one of: "low", "medium", "high", "critical". Consider keywords like "urgent", "ASAP", "immediate", "critical issue", deadlines, or lack thereof.
 - issue_request: A concise summary (1-3 sentences) of the main issue or request presented in the email.
 - tone: Characterize the overall tone of the email as one of: "polite", "neutral", "escalation", "threatening", "frustrated", "inquiring".
+"""
 
----
-Email Content:
+EMAIL_EXTRACTION_PROMPT = """Email Content:
 {email_content}
 
 ---
 JSON Output:
 """
 
+# Structured output schema: Gemini's response is guaranteed to be a JSON object with these fields.
+EMAIL_EXTRACTION_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "sender": {"type": "STRING"},
+        "urgency": {"type": "STRING", "enum": ["low", "medium", "high", "critical"]},
+        "issue_request": {"type": "STRING"},
+        "tone": {"type": "STRING", "enum": ["polite", "neutral", "escalation", "threatening", "frustrated", "inquiring"]}
+    },
+    "required": ["sender", "urgency", "issue_request", "tone"]
+}
+
+# Four short fields; only issue_request is free text (a one- or two-sentence summary).
+EMAIL_EXTRACTION_MAX_TOKENS = 300
+
+# --- Decisioning Rules ---
+# Urgency and tone are mapped to small integers once, then the chained action is a
+# single lookup in the decision matrix below. Unknown values fall back to "medium"/"neutral".
+_URGENCY = {"low": 0, "medium": 1, "high": 2, "critical": 3}
+_TONE = {"polite": 0, "neutral": 1, "inquiring": 2, "frustrated": 3, "escalation": 4, "threatening": 5}
+
+_LOG = "log_and_close_crm"
+_ESC = "escalate_crm"
+_ESC_RISK = "escalate_crm_and_risk_alert" # Threatening tone always escalates and raises a risk alert
+
+# Rows: urgency (low, medium, high, critical). Columns: tone (polite, neutral, inquiring, frustrated, escalation, threatening).
+_ACTION_TABLE = [
+    [_LOG, _LOG, _LOG, _LOG, _LOG, _ESC_RISK], # low
+    [_LOG, _LOG, _LOG, _LOG, _LOG, _ESC_RISK], # medium
+    [_LOG, _LOG, _LOG, _ESC, _ESC, _ESC_RISK], # high
+    [_ESC, _ESC, _ESC, _ESC, _ESC, _ESC_RISK], # critical
+]
+
+_ACTION_DETAILS = {
+    _LOG: "Log and close CRM: routine urgency/tone.",
+    _ESC: "Escalate CRM due to critical urgency, or high urgency with a frustrated/escalation tone.",
+    _ESC_RISK: "Threatening tone detected, escalating CRM and triggering risk alert.",
+}
+
 async def process_email(transaction_id: str):
     """
     Processes an email input, extracts structured fields, identifies tone and urgency,
@@ -43,18 +86,18 @@ async def process_email(transaction_id: str):
         # Update memory with error status if needed
         return
 
-    raw_email_str = transaction_data.get("raw_input_str")
-    if not raw_email_str:
-        error_msg = "Email Agent: raw_input_str not found for email processing."
+    raw_email_bytes = shared_memory.get_transaction_blob(transaction_id, shared_memory.RAW_INPUT_BLOB)
+    if not raw_email_bytes:
+        error_msg = "Email Agent: raw input not found for email processing."
         print(error_msg)
         shared_memory.update_transaction_data(transaction_id, {
             "agent_processed_by": "EmailAgent",
             "chained_action_triggered": "Log Error",
-            "error_message": error_msg,
-            "agent_decision_trace": transaction_data.get("agent_decision_trace", []) + [
-                {"agent": "EmailAgent", "step": "error", "details": error_msg}
-            ]
+            "error_message": error_msg
         })
+        shared_memory.append_decision_trace(transaction_id, [
+            {"agent": "EmailAgent", "step": "error", "details": error_msg}
+        ])
         return
 
     extracted_fields = {}
@@ -63,39 +106,19 @@ async def process_email(transaction_id: str):
     error_occurred = False
 
     try:
-        # Initial parsing to get subject and body more reliably for LLM
-        msg = email.message_from_string(raw_email_str)
-        subject_header = msg.get("Subject", "")
-        # Decode subject header properly
-        decoded_subject_parts = decode_header(subject_header)
-        subject = ""
-        for part, charset in decoded_subject_parts:
-            if isinstance(part, bytes):
-                try:
-                    subject += part.decode(charset if charset else 'utf-8')
-                except UnicodeDecodeError:
-                    subject += part.decode('latin-1', errors='ignore') # Fallback
-            else:
-                subject += part
-        
+        # Initial parsing to get subject and body more reliably for LLM.
+        # The default policy decodes RFC 2047 headers and transfer-encodings during parsing.
+        msg = BytesParser(policy=policy.default).parsebytes(raw_email_bytes)
+        subject = str(msg.get("Subject", ""))
+
         body_content = ""
-        if msg.is_multipart():
-            for part in msg.walk():
-                ctype = part.get_content_type()
-                cdispo = str(part.get('Content-Disposition'))
-                # Look for plain text body, avoiding attachments
-                if ctype == 'text/plain' and 'attachment' not in cdispo:
-                    try:
-                        body_content = part.get_payload(decode=True).decode('utf-8')
-                        break
-                    except Exception as e:
-                        print(f"Email Agent: Error decoding email part: {e}")
-                        body_content = "[Body content decode error]"
-        else:
+        # Look for plain text body, avoiding attachments
+        body_part = msg.get_body(preferencelist=('plain',)) if msg.is_multipart() else msg
+        if body_part is not None:
             try:
-                body_content = msg.get_payload(decode=True).decode('utf-8')
+                body_content = body_part.get_content()
             except Exception as e:
-                print(f"Email Agent: Error decoding single part email: {e}")
+                print(f"Email Agent: Error decoding email body: {e}")
                 body_content = "[Body content decode error]"
 
         # Combine subject and body for LLM processing
@@ -103,9 +126,16 @@ async def process_email(transaction_id: str):
         decision_trace.append({"agent": "EmailAgent", "step": "extracted_for_llm", "details": {"subject": subject, "body_snippet": llm_input_content[:500] + "..."}})
 
         # 2. Use LLM to extract structured fields
-        llm_response_json_str = await llm_client.call_gemini_for_extraction(
-            prompt_template=EMAIL_EXTRACTION_PROMPT,
-            text_to_process=llm_input_content
+        llm_response_json_str = await llm_cache.cached_call(
+            "email_extract",
+            llm_input_content,
+            lambda: llm_client.call_gemini_for_extraction(
+                prompt_template=EMAIL_EXTRACTION_PROMPT,
+                text_to_process=llm_input_content,
+                system_instruction=EMAIL_EXTRACTION_SYSTEM_INSTRUCTION,
+                response_schema=EMAIL_EXTRACTION_RESPONSE_SCHEMA,
+                max_output_tokens=EMAIL_EXTRACTION_MAX_TOKENS
+            )
         )
         
         try:
@@ -132,24 +162,10 @@ async def process_email(transaction_id: str):
 
         # 3. Decisioning based on extracted fields (tone + urgency)
         if not error_occurred:
-            urgency = extracted_fields.get("urgency", "").lower()
-            tone = extracted_fields.get("tone", "").lower()
-
-            if urgency == "critical" or urgency == "high" and (tone == "escalation" or tone == "threatening" or tone == "frustrated"):
-                chained_action = "escalate_crm"
-                decision_trace.append({"agent": "EmailAgent", "step": "action_decision", "details": "Escalate CRM due to high urgency and critical/escalation/threatening tone."})
-            elif urgency == "low" or urgency == "medium":
-                chained_action = "log_and_close_crm"
-                decision_trace.append({"agent": "EmailAgent", "step": "action_decision", "details": "Log and close CRM due to low/medium urgency."})
-            else:
-                chained_action = "log_and_close_crm" # Default routine action if no specific match
-                decision_trace.append({"agent": "EmailAgent", "step": "action_decision", "details": "Default log and close CRM action."})
-            
-            # Additional check for threatening tone regardless of urgency for potential immediate flagging
-            if tone == "threatening":
-                chained_action = "escalate_crm_and_risk_alert" # Combined action
-                decision_trace.append({"agent": "EmailAgent", "step": "action_decision", "details": "Threatening tone detected, escalating CRM and triggering risk alert."})
-
+            urgency = _URGENCY.get(str(extracted_fields.get("urgency", "")).lower(), _URGENCY["medium"])
+            tone = _TONE.get(str(extracted_fields.get("tone", "")).lower(), _TONE["neutral"])
+            chained_action = _ACTION_TABLE[urgency][tone]
+            decision_trace.append({"agent": "EmailAgent", "step": "action_decision", "details": _ACTION_DETAILS[chained_action]})
 
     except Exception as e:
         error_msg = f"Email Agent: General processing error for transaction {transaction_id}: {e}"
@@ -163,11 +179,11 @@ async def process_email(transaction_id: str):
         "agent_processed_by": "EmailAgent",
         "extracted_data": extracted_fields,
         "chained_action_triggered": chained_action,
-        "agent_decision_trace": transaction_data.get("agent_decision_trace", []) + decision_trace,
         "email_agent_status": "completed" if not error_occurred else "failed"
     }
     if error_occurred:
         update_data["error_message"] = error_msg
         
     shared_memory.update_transaction_data(transaction_id, update_data)
+    shared_memory.append_decision_trace(transaction_id, decision_trace) # Append to existing trace
     print(f"Email Agent: Finished processing transaction {transaction_id}. Action: {chained_action}")
\ No newline at end of file
@@ -1,8 +1,14 @@
 # your_project_name/agents/json_agent.py
 
-import json
+import os
+import codecs
+import orjson
+import asyncio
+import numpy as np
 from typing import Dict, Any, Optional
 import jsonschema # Make sure you have 'pip install jsonschema'
+from jsonschema import Draft202012Validator
+from jsonschema.exceptions import best_match
 
 from ..core import shared_memory
 # from ..core import llm_client # Uncomment only if JSON agent needs LLM for complex anomaly detection
@@ -77,6 +83,21 @@ JSON_SCHEMAS: Dict[str, Dict[str, Any]] = {
     # but you could define a generic one if needed.
 }
 
+# Build one validator per intent at import time so the schemas are checked and
+# compiled once rather than on every request.
+JSON_VALIDATORS: Dict[str, Draft202012Validator] = {
+    intent: Draft202012Validator(schema) for intent, schema in JSON_SCHEMAS.items()
+}
+
+# Documents at least this large are parsed and validated in a worker thread (the app's
+# bounded default executor) so they don't stall the event loop; smaller ones are handled
+# inline, where the thread hop would cost more than the work itself.
+JSON_OFFLOAD_MIN_BYTES = int(os.getenv("JSON_OFFLOAD_MIN_BYTES", 64 * 1024))
+
+def _best_validation_error(validator: Draft202012Validator, json_data: Any) -> Optional[jsonschema.ValidationError]:
+    """Returns the most relevant schema validation error, or None if the document is valid."""
+    return best_match(validator.iter_errors(json_data))
+
 
 async def process_json(transaction_id: str):
     """
@@ -93,18 +114,18 @@ async def process_json(transaction_id: str):
         print(f"JSON Agent: Error - Transaction {transaction_id} not found in memory.")
         return
 
-    raw_json_str = transaction_data.get("raw_input_str")
+    raw_json_bytes = shared_memory.get_transaction_blob(transaction_id, shared_memory.RAW_INPUT_BLOB)
     detected_intent = transaction_data.get("classifier_output", {}).get("intent")
 
     extracted_data = {}
     chained_action = "None"
-    decision_trace = transaction_data.get("agent_decision_trace", [])
+    decision_trace = [] # New entries only; appended to the stored trace at the end
     error_occurred = False
     anomaly_details = []
 
-    # Ensure raw_json_str exists for processing
-    if not raw_json_str:
-        error_msg = "JSON Agent: raw_input_str (JSON content) not found for processing."
+    # Ensure the raw JSON exists for processing
+    if not raw_json_bytes:
+        error_msg = "JSON Agent: raw input (JSON content) not found for processing."
         print(error_msg)
         anomaly_details.append({"type": "MISSING_JSON_CONTENT", "message": error_msg})
         error_occurred = True
@@ -115,20 +136,26 @@ async def process_json(transaction_id: str):
             "agent_processed_by": "JsonAgent",
             "extracted_data": extracted_data,
             "chained_action_triggered": "Log Alert",
-            "agent_decision_trace": decision_trace,
             "json_agent_status": "failed",
             "anomaly_details": anomaly_details,
             "error_message": error_msg
         })
+        shared_memory.append_decision_trace(transaction_id, decision_trace)
         return # Exit early
 
+    offload = len(raw_json_bytes) >= JSON_OFFLOAD_MIN_BYTES
+
     try:
         # 1. Parse JSON content
         try:
-            json_data = json.loads(raw_json_str)
-            extracted_data["parsed_json"] = json_data
+            # orjson rejects a UTF-8 BOM, which some editors prepend to .json files
+            json_bytes = raw_json_bytes.removeprefix(codecs.BOM_UTF8)
+            json_data = await asyncio.to_thread(orjson.loads, json_bytes) if offload else orjson.loads(json_bytes)
+            # Keep only a fingerprint and preview; the full document stays in the raw_input blob.
+            extracted_data["parsed_json_sha256"] = transaction_data.get("raw_input_sha256")
+            extracted_data["snippet"] = raw_json_bytes[:256].decode("utf-8", errors="ignore")
             decision_trace.append({"agent": "JsonAgent", "step": "json_parsed", "details": "Successfully parsed JSON content."})
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             error_msg = f"JSON Agent: Invalid JSON format: {e}"
             print(error_msg)
             anomaly_details.append({"type": "JSON_PARSE_ERROR", "message": str(e)})
@@ -139,10 +166,15 @@ async def process_json(transaction_id: str):
             raise # Re-raise to go to outer exception handler for unified logging
 
         # 2. Validate against schema if intent is recognized and a schema exists
-        schema = JSON_SCHEMAS.get(detected_intent)
-        if schema:
+        validator = JSON_VALIDATORS.get(detected_intent)
+        if validator:
             try:
-                jsonschema.validate(instance=json_data, schema=schema)
+                if offload:
+                    validation_error = await asyncio.to_thread(_best_validation_error, validator, json_data)
+                else:
+                    validation_error = _best_validation_error(validator, json_data)
+                if validation_error is not None:
+                    raise validation_error
                 decision_trace.append({"agent": "JsonAgent", "step": "schema_validation", "details": f"Validated against {detected_intent} schema: OK."})
             except jsonschema.ValidationError as e:
                 error_msg = f"JSON Agent: Schema validation failed for intent '{detected_intent}': {e.message}"
@@ -164,15 +196,21 @@ async def process_json(transaction_id: str):
         # Example: For an RFQ, check if quantity is positive for any item.
         if detected_intent == "RFQ" and not anomaly_details: # Only run if no critical anomalies yet
             items = json_data.get("items", [])
-            for i, item in enumerate(items):
-                if item.get("quantity") is not None and item.get("quantity") <= 0:
-                    anomaly_details.append({
-                        "type": "BUSINESS_RULE_VIOLATION",
-                        "rule": "RFQ_QUANTITY_POSITIVE",
-                        "message": f"RFQ item at index {i} has non-positive quantity: {item.get('quantity')}",
-                        "path": f"items[{i}].quantity"
-                    })
-                    error_occurred = True
+            # Scan all quantities in one vectorized comparison; missing/non-numeric quantities become NaN and never match.
+            quantities = np.fromiter(
+                (item.get("quantity") if isinstance(item.get("quantity"), (int, float)) else np.nan for item in items),
+                dtype=np.float64,
+                count=len(items)
+            )
+            for i in np.flatnonzero(quantities <= 0):
+                item = items[i]
+                anomaly_details.append({
+                    "type": "BUSINESS_RULE_VIOLATION",
+                    "rule": "RFQ_QUANTITY_POSITIVE",
+                    "message": f"RFQ item at index {i} has non-positive quantity: {item.get('quantity')}",
+                    "path": f"items[{i}].quantity"
+                })
+                error_occurred = True
             if anomaly_details: # If any business rule anomalies are found here
                 decision_trace.append({"agent": "JsonAgent", "step": "business_rule_check", "details": "Business rule anomalies detected for RFQ."})
 
@@ -181,7 +219,11 @@ async def process_json(transaction_id: str):
             total_amount_invoice = json_data.get("total_amount")
             line_items = json_data.get("line_items")
             if isinstance(total_amount_invoice, (int, float)) and isinstance(line_items, list) and line_items:
-                calculated_total = sum(item.get("line_total", 0) for item in line_items if isinstance(item.get("line_total"), (int, float)))
+                line_totals = np.fromiter(
+                    (item.get("line_total") for item in line_items if isinstance(item.get("line_total"), (int, float))),
+                    dtype=np.float64
+                )
+                calculated_total = float(line_totals.sum())
                 # Allow a small floating point difference
                 if abs(total_amount_invoice - calculated_total) > 0.01:
                     anomaly_details.append({
@@ -220,7 +262,6 @@ async def process_json(transaction_id: str):
         "agent_processed_by": "JsonAgent",
         "extracted_data": extracted_data,
         "chained_action_triggered": chained_action,
-        "agent_decision_trace": transaction_data.get("agent_decision_trace", []) + decision_trace, # Append to existing trace
         "json_agent_status": "completed" if not error_occurred else "failed",
         "anomaly_details": anomaly_details # Store all detected anomalies
     }
@@ -230,4 +271,5 @@ async def process_json(transaction_id: str):
         update_data["error_message"] = f"JSON Agent failed: {full_error_summary}"
 
     shared_memory.update_transaction_data(transaction_id, update_data)
+    shared_memory.append_decision_trace(transaction_id, decision_trace) # Append to existing trace
     print(f"JSON Agent: Finished processing transaction {transaction_id}. Action: {chained_action}")
\ No newline at end of file
@@ -1,16 +1,20 @@
 # your_project_name/agents/pdf_agent.py
 
-import io
-import base64
+import os
 import re
-import pypdf
-from typing import Dict, Any, Optional
+import logging
+import asyncio
+from typing import Dict, Any, List, Optional
 import json
 
 from ..core import shared_memory
 from ..core import llm_client
+from ..core import llm_cache
+from ..core import pdf_text
 from ..models.schemas import INVOICE_JSON_SCHEMA # Import the schema
 
+log = logging.getLogger(__name__)
+
 # --- LLM Prompt for Invoice Data Extraction ---
 # This prompt guides the LLM to extract structured invoice data from the provided text.
 # It explicitly asks for JSON output matching the schema.
@@ -29,6 +33,16 @@ Invoice Text:
 Extracted Invoice Data (JSON):
 """
 
+# The schema is constant, so it is serialized into the prompt once at import time and
+# the prompt is split around {invoice_text}; per call only the invoice text is spliced in.
+# (str.format can't be used on the result: the embedded schema JSON is full of braces.)
+_INVOICE_PROMPT_HEAD, _INVOICE_PROMPT_TAIL = INVOICE_EXTRACTION_PROMPT.replace(
+    "{json_schema}", json.dumps(INVOICE_JSON_SCHEMA, indent=2)
+).split("{invoice_text}")
+
+# Output budget for the invoice JSON (header fields plus line items).
+INVOICE_EXTRACTION_MAX_TOKENS = 600
+
 # --- LLM Prompt for Policy Compliance Keyword Detection ---
 # This prompt helps identify relevant keywords in policy documents.
 POLICY_KEYWORD_PROMPT = """
@@ -41,6 +55,36 @@ Policy Document Text:
 Mentioned Compliance Terms (comma-separated, e.g., GDPR, HIPAA):
 """
 
+# The answer is at most a short comma-separated list of the six terms.
+POLICY_KEYWORD_MAX_TOKENS = 200
+
+# The compliance terms are a fixed set, so they are matched locally with one compiled regex
+# instead of an LLM round trip. Whitespace variants (e.g. "ISO27001") are normalized
+# back to the canonical spelling used in POLICY_KEYWORD_PROMPT.
+_COMPLIANCE_RE = re.compile(r'\b(GDPR|FDA|HIPAA|PCI\s*DSS|ISO\s*27001|NIST)\b', re.IGNORECASE)
+_COMPLIANCE_CANONICAL = {"PCIDSS": "PCI DSS", "ISO27001": "ISO 27001"}
+
+# Ask the LLM only when the regex finds nothing (e.g. terms phrased unusually). Off by default.
+POLICY_KEYWORD_LLM_FALLBACK = os.getenv("POLICY_KEYWORD_LLM_FALLBACK", "false").lower() in ("1", "true", "yes")
+
+def _find_compliance_terms(text: str) -> List[str]:
+    """Returns the sorted, de-duplicated compliance terms mentioned in the text."""
+    terms = set()
+    for match in _COMPLIANCE_RE.finditer(text):
+        term = re.sub(r"\s+", "", match.group(1).upper())
+        terms.add(_COMPLIANCE_CANONICAL.get(term, term))
+    return sorted(terms)
+
+# Maximum number of PDF transactions processed at once by process_pdf_batch
+PDF_BATCH_CONCURRENCY = int(os.getenv("PDF_BATCH_CONCURRENCY", 16))
+
+# Every PDF starts with this header. Payloads routed here only by their declared
+# content type or file extension may not, and are rejected before parsing.
+PDF_MAGIC = b"%PDF-"
+
+# Limit text extraction to prevent excessively long LLM calls
+MAX_EXTRACTED_CHARS = 5000 # Adjust limit as needed
+
 async def process_pdf(transaction_id: str):
     """
     Processes a PDF input:
@@ -51,39 +95,43 @@ async def process_pdf(transaction_id: str):
     - Updates shared memory with extracted data and flags.
     - Proposes a chained action.
     """
-    print(f"PDF Agent: Processing transaction {transaction_id}")
+    log.info("PDF Agent: Processing transaction %s", transaction_id)
     transaction_data = shared_memory.get_transaction_data(transaction_id)
 
     if not transaction_data:
-        print(f"PDF Agent: Error - Transaction data not found for {transaction_id}")
+        log.error("PDF Agent: Error - Transaction data not found for %s", transaction_id)
         await _update_and_flag_error(transaction_id, "PDF Agent: Transaction data not found.")
         return
 
     detected_intent = transaction_data.get("classifier_output", {}).get("intent")
-    raw_pdf_base664 = transaction_data.get("raw_input_pdf_base64")
+    pdf_bytes = shared_memory.get_transaction_blob(transaction_id, shared_memory.RAW_INPUT_BLOB)
 
-    if not raw_pdf_base664:
-        print(f"PDF Agent: Error - No raw PDF content found for {transaction_id}")
+    if not pdf_bytes:
+        log.error("PDF Agent: Error - No raw PDF content found for %s", transaction_id)
         await _update_and_flag_error(transaction_id, "PDF Agent: No raw PDF content found.")
         return
 
-    pdf_bytes = base64.b64decode(raw_pdf_base664)
-    extracted_text = ""
+    # Cheap header check so mislabelled uploads never reach the parser; corrupt PDFs
+    # are caught by the extraction error path below
+    if not pdf_bytes.startswith(PDF_MAGIC):
+        log.error("PDF Agent: Error - Content for %s is not a PDF (missing %%PDF- header)", transaction_id)
+        await _update_and_flag_error(transaction_id, "PDF Agent: Content is not a PDF (missing %PDF- header).")
+        return
+
     try:
-        reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
-        for i, page in enumerate(reader.pages):
-            extracted_text += page.extract_text() or ""
-            # Limit text extraction to prevent excessively long LLM calls
-            if len(extracted_text) > 5000: # Adjust limit as needed
-                break
+        # PDF parsing is CPU-bound; run it off the event loop so concurrent transactions keep flowing.
+        extracted_text = await asyncio.to_thread(pdf_text.extract_pdf_text, pdf_bytes, MAX_EXTRACTED_CHARS, skip_fontless=True)
+        # Only the text is needed from here on; don't keep the PDF resident across the LLM round trip.
+        del pdf_bytes
     except Exception as e:
-        print(f"PDF Agent: Error extracting text from PDF for {transaction_id}: {e}")
+        log.error("PDF Agent: Error extracting text from PDF for %s: %s", transaction_id, e)
         await _update_and_flag_error(transaction_id, f"PDF Agent: Failed to extract text from PDF: {e}")
         return
 
+    snippet = extracted_text[:1000]
     pdf_agent_output = {
-        "extracted_text_snippet": extracted_text[:1000] + "..." if len(extracted_text) > 1000 else extracted_text,
-        "full_text_extracted": len(extracted_text) > 0,
+        "extracted_text_snippet": snippet + "..." if len(extracted_text) > len(snippet) else snippet,
+        "full_text_extracted": bool(extracted_text),
         "processed_by": "PDFAgent"
     }
     flagged_conditions = []
@@ -91,17 +139,20 @@ async def process_pdf(transaction_id: str):
     error_message = None
 
     if detected_intent == "Invoice":
-        print(f"PDF Agent: Intent is 'Invoice'. Attempting structured extraction for {transaction_id}...")
+        log.info("PDF Agent: Intent is 'Invoice'. Attempting structured extraction for %s...", transaction_id)
         extracted_invoice_data = {}
         try:
-            # Format the prompt directly, passing the schema and text
-            formatted_invoice_prompt = INVOICE_EXTRACTION_PROMPT.format(
-                json_schema=json.dumps(INVOICE_JSON_SCHEMA, indent=2),
-                invoice_text=extracted_text
-            )
-            llm_result = await llm_client.call_gemini_for_extraction(
-                prompt_template=formatted_invoice_prompt,
-                text_to_process=None # No need for text_to_process as prompt is fully formatted
+            # Splice the text into the precomputed prompt (schema already embedded)
+            formatted_invoice_prompt = "".join((_INVOICE_PROMPT_HEAD, extracted_text, _INVOICE_PROMPT_TAIL))
+            # Keyed on the full prompt, so re-runs of the same invoice skip the round trip
+            llm_result = await llm_cache.cached_call(
+                "invoice_extract",
+                formatted_invoice_prompt,
+                lambda: llm_client.call_gemini_for_extraction(
+                    prompt_template=formatted_invoice_prompt,
+                    text_to_process=None, # No need for text_to_process as prompt is fully formatted
+                    max_output_tokens=INVOICE_EXTRACTION_MAX_TOKENS
+                )
             )
 
             if llm_result.get("error"):
@@ -118,37 +169,45 @@ async def process_pdf(transaction_id: str):
 
         except Exception as e:
             error_message = f"PDF Agent: Error extracting invoice data: {e}"
-            print(error_message)
+            log.error(error_message)
             flagged_conditions.append({"type": "Extraction_Error", "details": str(e)})
             chained_action = "Log Error" # Log error if extraction fails
 
     elif detected_intent == "Regulation":
-        print(f"PDF Agent: Intent is 'Regulation'. Checking for compliance keywords for {transaction_id}...")
-        # Call LLM for compliance keyword detection
-        formatted_policy_prompt = POLICY_KEYWORD_PROMPT.format(policy_text=extracted_text)
-        llm_result = await llm_client.call_ollama_for_extraction(
-            prompt_template=formatted_policy_prompt,
-            text_to_process=None # No need for text_to_process as prompt is fully formatted
-        )
-        
-        if llm_result.get("error"):
-            error_message = f"PDF Agent: LLM error during compliance keyword check: {llm_result['error']}"
-            print(error_message)
-            flagged_conditions.append({"type": "LLM_Error_Compliance", "details": error_message})
-            chained_action = "Log Error"
-        else:
-            # Expecting 'response' key from llm_client if no JSON was found
-            compliance_keywords_str = llm_result.get("response", "") 
-            found_terms = [term.strip() for term in compliance_keywords_str.split(',') if term.strip() and term.strip().lower() != 'none']
-            
-            if found_terms:
-                flagged_conditions.append({"type": "Compliance_Keyword_Detected", "terms": found_terms})
-                chained_action = "Log Alert" # Trigger an alert for specific compliance terms
-            
-            pdf_agent_output["detected_compliance_terms"] = found_terms
+        log.info("PDF Agent: Intent is 'Regulation'. Checking for compliance keywords for %s...", transaction_id)
+        found_terms = _find_compliance_terms(extracted_text)
+
+        if not found_terms and POLICY_KEYWORD_LLM_FALLBACK:
+            log.info("PDF Agent: No compliance terms matched locally for %s. Falling back to LLM.", transaction_id)
+            formatted_policy_prompt = POLICY_KEYWORD_PROMPT.format(policy_text=extracted_text)
+            llm_result = await llm_cache.cached_call(
+                "policy_keywords",
+                formatted_policy_prompt,
+                lambda: llm_client.call_gemini_for_extraction(
+                    prompt_template=formatted_policy_prompt,
+                    text_to_process=None, # No need for text_to_process as prompt is fully formatted
+                    max_output_tokens=POLICY_KEYWORD_MAX_TOKENS
+                )
+            )
+
+            if llm_result.get("error"):
+                error_message = f"PDF Agent: LLM error during compliance keyword check: {llm_result['error']}"
+                log.error(error_message)
+                flagged_conditions.append({"type": "LLM_Error_Compliance", "details": error_message})
+                chained_action = "Log Error"
+            else:
+                # Expecting 'response' key from llm_client if no JSON was found
+                compliance_keywords_str = llm_result.get("response", "")
+                found_terms = [term.strip() for term in compliance_keywords_str.split(',') if term.strip() and term.strip().lower() != 'none']
+
+        if found_terms:
+            flagged_conditions.append({"type": "Compliance_Keyword_Detected", "terms": found_terms})
+            chained_action = "Log Alert" # Trigger an alert for specific compliance terms
+
+        pdf_agent_output["detected_compliance_terms"] = found_terms
 
     else:
-        print(f"PDF Agent: Intent '{detected_intent}' not specifically handled for PDF. No structured extraction or flagging.")
+        log.info("PDF Agent: Intent '%s' not specifically handled for PDF. No structured extraction or flagging.", detected_intent)
         pdf_agent_output["status"] = "No specific PDF processing for this intent."
         chained_action = "None" # No action for unhandled PDF types
 
@@ -164,7 +223,24 @@ async def process_pdf(transaction_id: str):
         update_fields["final_status"] = "pdf_agent_error"
 
     shared_memory.update_transaction_data(transaction_id, update_fields)
-    print(f"PDF Agent: Finished processing {transaction_id}. Chained action: {chained_action}")
+    log.info("PDF Agent: Finished processing %s. Chained action: %s", transaction_id, chained_action)
+
+async def process_pdf_batch(transaction_ids: List[str]) -> List[Any]:
+    """
+    Processes several PDF transactions concurrently (e.g. bulk invoice ingestion),
+    so their extraction and LLM round trips overlap instead of running back to back.
+    At most PDF_BATCH_CONCURRENCY transactions are processed at once; Gemini calls
+    are additionally bounded by llm_client's shared concurrency limit.
+
+    Returns one entry per transaction: None on success, or the raised exception.
+    """
+    semaphore = asyncio.Semaphore(PDF_BATCH_CONCURRENCY)
+
+    async def _process_one(transaction_id: str):
+        async with semaphore:
+            return await process_pdf(transaction_id)
+
+    return await asyncio.gather(*(_process_one(tid) for tid in transaction_ids), return_exceptions=True)
 
 async def _update_and_flag_error(transaction_id: str, message: str):
     """Helper to update shared memory with an error and propose 'Log Error' action."""
@@ -175,4 +251,4 @@ async def _update_and_flag_error(transaction_id: str, message: str):
         "error_message": message,
         "final_status": "pdf_agent_error"
     })
-    print(f"PDF Agent Error for {transaction_id}: {message}")
\ No newline at end of file
+    log.error("PDF Agent Error for %s: %s", transaction_id, message)
\ No newline at end of file
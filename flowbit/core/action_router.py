@@ -1,56 +1,67 @@
 # your_project_name/core/action_router.py
 
+import logging
 import httpx # Changed from 'requests' to 'httpx' for async compatibility
 from typing import Dict, Any
 
 from . import shared_memory # Import shared_memory for updating trace
 
+log = logging.getLogger(__name__)
+
 FASTAPI_BASE_URL = "http://localhost:8000" # Base URL for your own FastAPI app's external service endpoints
 
+# Endpoint path for each supported action.
+ACTION_ENDPOINTS: Dict[str, str] = {
+    "CRM_Escalate": "/crm/escalate",
+    "CRM_LogAndClose": "/crm/log_and_close",
+    "Risk_Alert": "/risk_alert",
+}
+
+# Shared client so actions reuse pooled keep-alive connections instead of
+# opening a new connection per call. Closed on app shutdown via close_client().
+_client = httpx.AsyncClient(
+    base_url=FASTAPI_BASE_URL,
+    timeout=30,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+)
+
+async def close_client():
+    """Closes the shared HTTP client. Call once on application shutdown."""
+    await _client.aclose()
+
 async def trigger_action(transaction_id: str, proposed_action: str, action_details: Dict[str, Any]):
     """
     Triggers an external action based on the proposed_action.
     Updates the shared memory trace with the action outcome.
     """
-    print(f"Action Router: Triggering action '{proposed_action}' for transaction {transaction_id}")
+    log.info("Action Router: Triggering action '%s' for transaction %s", proposed_action, transaction_id)
     action_status = "failed"
     action_response = {}
-    endpoint = None
+    endpoint = ACTION_ENDPOINTS.get(proposed_action)
 
     try:
-        async with httpx.AsyncClient() as client: # Use httpx.AsyncClient for async requests
-            if proposed_action == "CRM_Escalate":
-                endpoint = f"{FASTAPI_BASE_URL}/crm/escalate"
-                response = await client.post(endpoint, json=action_details, timeout=30) # Add timeout
-            elif proposed_action == "CRM_LogAndClose":
-                endpoint = f"{FASTAPI_BASE_URL}/crm/log_and_close"
-                response = await client.post(endpoint, json=action_details, timeout=30)
-            elif proposed_action == "Risk_Alert":
-                endpoint = f"{FASTAPI_BASE_URL}/risk_alert"
-                response = await client.post(endpoint, json=action_details, timeout=30)
-            else:
-                action_status = "unsupported_action"
-                action_response = {"message": f"Unsupported action: {proposed_action}"}
-                print(f"Action Router: {action_response['message']}")
-                # No HTTP call needed for unsupported action, so skip raising for status
-                response = None # Indicate no response object to avoid AttributeError later
-
-            if response: # Only process response if an endpoint was triggered
-                response.raise_for_status() # Raises httpx.HTTPStatusError for 4xx/5xx responses
-                action_response = response.json()
-                action_status = "success"
-                print(f"Action Router: Action '{proposed_action}' successful. Response: {action_response}")
+        if endpoint:
+            response = await _client.post(endpoint, json=action_details)
+            response.raise_for_status() # Raises httpx.HTTPStatusError for 4xx/5xx responses
+            action_response = response.json()
+            action_status = "success"
+            log.info("Action Router: Action '%s' successful. Response: %s", proposed_action, action_response)
+        else:
+            # No HTTP call needed for unsupported action
+            action_status = "unsupported_action"
+            action_response = {"message": f"Unsupported action: {proposed_action}"}
+            log.warning("Action Router: %s", action_response['message'])
 
     except httpx.ConnectError: # Specific httpx connection error
-        print(f"Action Router Error: Could not connect to FastAPI at {FASTAPI_BASE_URL}. Is it running?")
+        log.error("Action Router Error: Could not connect to FastAPI at %s. Is it running?", FASTAPI_BASE_URL)
         action_status = "connection_error"
         action_response = {"error": "FastAPI backend connection refused"}
     except httpx.RequestError as e: # Catch all other httpx request errors (e.g., timeout, HTTP status)
-        print(f"Action Router Error during action '{proposed_action}' to {endpoint}: {e}")
+        log.error("Action Router Error during action '%s' to %s: %s", proposed_action, endpoint, e)
         action_status = "http_error"
         action_response = {"error": str(e), "response_text": getattr(e.response, 'text', 'No response text')}
     except Exception as e:
-        print(f"Action Router Error: An unexpected error occurred for '{proposed_action}': {e}")
+        log.error("Action Router Error: An unexpected error occurred for '%s': %s", proposed_action, e)
         action_status = "internal_error"
         action_response = {"error": str(e)}
 
@@ -63,11 +74,7 @@ async def trigger_action(transaction_id: str, proposed_action: str, action_detai
         "response": action_response
     }
     
-    current_data = shared_memory.get_transaction_data(transaction_id)
-    if current_data:
-        if "agent_decision_trace" not in current_data:
-            current_data["agent_decision_trace"] = []
-        current_data["agent_decision_trace"].append(trace_entry)
-        shared_memory.set_transaction_data(transaction_id, current_data)
-    else:
-        print(f"Action Router Warning: Transaction {transaction_id} not found in shared memory for trace update.")
\ No newline at end of file
+    # Only the new entry is written (RPUSH onto the trace list); the rest of the
+    # transaction is never fetched or rewritten here.
+    if not shared_memory.append_decision_trace(transaction_id, [trace_entry]):
+        log.warning("Action Router Warning: Transaction %s not found in shared memory for trace update.", transaction_id)
@@ -0,0 +1,89 @@
+# your_project_name/core/llm_batcher.py
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+# --- Configure Logging ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class MicroBatcher:
+    """
+    Coalesces single-item LLM requests that arrive within a short window into one
+    batched call, then fans the results back out to each waiting caller.
+
+    Callers simply `await batcher.submit(item)`. A background task collects up to
+    `max_batch` items (waiting at most `window_ms` after the first one) and hands them
+    to `batch_fn`. If `batch_fn` returns None, or only one item was collected, each
+    item is sent through `single_fn` instead.
+    """
+
+    def __init__(
+        self,
+        single_fn: Callable[[Any], Awaitable[Any]],
+        batch_fn: Callable[[List[Any]], Awaitable[Optional[List[Any]]]],
+        max_batch: int = 8,
+        window_ms: int = 20,
+    ):
+        self.single_fn = single_fn
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.window_s = window_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Strong references to in-flight dispatch tasks; the event loop only keeps weak
+        # ones, so an unreferenced task could be garbage-collected before it finishes.
+        self._dispatch_tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Queues an item for the next batch and waits for its individual result."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def _ensure_worker(self):
+        # The queue and worker are created lazily so they bind to the running event loop.
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._collect_batches())
+
+    async def _collect_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without awaiting so the next window can start collecting immediately.
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatch_tasks.add(task)
+            task.add_done_callback(self._dispatch_tasks.discard)
+
+    async def _dispatch(self, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            results = None
+            if len(items) > 1:
+                results = await self.batch_fn(items)
+                if results is not None and len(results) != len(items):
+                    logging.warning(f"LLM Batcher: Batch returned {len(results)} results for {len(items)} items. Falling back to single calls.")
+                    results = None
+            if results is None:
+                results = await asyncio.gather(*(self.single_fn(item) for item in items))
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            logging.error(f"LLM Batcher: Batch dispatch failed: {e}", exc_info=True)
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
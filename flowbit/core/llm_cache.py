@@ -0,0 +1,92 @@
+# your_project_name/core/llm_cache.py
+
+import os
+import copy
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from cachetools import TTLCache
+
+# --- Configure Logging ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Cache Configuration ---
+# Read cache configuration from environment variables, with defaults for local development.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAXSIZE = int(os.getenv("LLM_CACHE_MAXSIZE", 10_000))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 3600)) # Seconds
+
+# Exact-match response cache shared by all LLM call kinds (classification, extraction, ...).
+_response_cache: TTLCache = TTLCache(maxsize=LLM_CACHE_MAXSIZE, ttl=LLM_CACHE_TTL)
+
+# Result future per key currently being computed, so concurrent identical requests
+# wait for the first call's result instead of all hitting the API (single-flight).
+_inflight: Dict[bytes, asyncio.Future] = {}
+
+# Sentinel results returned by llm_client on failure. These must never be cached,
+# otherwise a transient API error would be replayed for the whole TTL.
+_UNCACHEABLE_RESULTS = {"LLM_Error", "LLM_Blocked", "Gemini_API_Error"}
+
+
+def _make_key(kind: str, text: str) -> bytes:
+    """Builds the cache key for a given call kind and input text."""
+    return hashlib.blake2b(f"{kind}\n{text}".encode("utf-8"), digest_size=16).digest()
+
+
+def _is_cacheable(result: Any) -> bool:
+    """Only successful LLM results are cached."""
+    if isinstance(result, str):
+        return result not in _UNCACHEABLE_RESULTS
+    if isinstance(result, dict):
+        return "error" not in result
+    return result is not None
+
+
+async def cached_call(kind: str, text: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Returns the cached LLM result for (kind, text) if present, otherwise awaits fn()
+    and caches its result.
+
+    Args:
+        kind (str): Namespace for the call (e.g. "classify", "email_extract").
+        text (str): The input text (or fully formatted prompt) sent to the LLM; identical text yields a cache hit.
+        fn (Callable[[], Awaitable[Any]]): Zero-argument coroutine factory performing the real LLM call.
+
+    Returns:
+        Any: The LLM result. Dicts are returned as copies so callers can mutate them freely.
+    """
+    if not LLM_CACHE_ENABLED:
+        return await fn()
+
+    key = _make_key(kind, text)
+    cached = _response_cache.get(key)
+    if cached is not None:
+        logging.info(f"LLM Cache: Hit for '{kind}' call.")
+        return copy.deepcopy(cached)
+
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        logging.info(f"LLM Cache: Waiting on in-flight '{kind}' call.")
+        return copy.deepcopy(await asyncio.shield(inflight))
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await fn()
+        if _is_cacheable(result):
+            _response_cache[key] = copy.deepcopy(result)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception() # Mark as retrieved in case nobody else was waiting
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+
+def clear_cache():
+    """Drops every cached LLM response."""
+    _response_cache.clear()
@@ -1,11 +1,16 @@
 import os
+import asyncio
 import json
 import re
+import orjson
+import functools
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
 import google.generativeai as genai
-# We don't need to import httpx directly here as google-generativeai's async methods handle it.
+# We don't need an httpx/aiohttp client here: google-generativeai creates one default
+# async gRPC client per process (HTTP/2, multiplexed) and every GenerativeModel instance,
+# including the per-system-instruction models below, reuses that same channel.
 
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,6 +19,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Global variable for the Gemini model instance.
 # This ensures the model is initialized only once when the module is loaded.
 _gemini_model = None
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash-latest")
 
 def _initialize_gemini_model():
     """
@@ -30,16 +36,118 @@ def _initialize_gemini_model():
         genai.configure(api_key=api_key)
         
         # We'll use gemini-1.5-flash-latest for faster responses.
-        # You can switch to 'gemini-1.5-pro-latest' for more complex reasoning if needed.
-        _gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest') 
+        # You can switch to 'gemini-1.5-pro-latest' for more complex reasoning if needed,
+        # or to a Gemini 2.5 model, which applies implicit prefix caching automatically.
+        _gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
         logging.info(f"Gemini LLM initialized with model: {_gemini_model.model_name}")
 
+# Shared decoder for pulling the first JSON object out of a free-form LLM response.
+_json_decoder = json.JSONDecoder()
+
+# Matches the first "{name}" placeholder in an extraction prompt template.
+_PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+# Intent categories the classifier prompts are allowed to return.
+VALID_LLM_INTENTS = ("RFQ", "Complaint", "Invoice", "Regulation", "Fraud Risk", "Other")
+
+# Response schema that constrains classification output to exactly one of the intents.
+CLASSIFICATION_RESPONSE_SCHEMA = {"type": "STRING", "enum": list(VALID_LLM_INTENTS)}
+# Output budget per text in a batch classification response (one short key/value pair each).
+BATCH_CLASSIFICATION_TOKENS_PER_TEXT = 15
+
+# Models carrying a system instruction, memoized per instruction. Static prompt
+# content (instructions, few-shot examples) lives in the system instruction so each
+# request only sends the variable text.
+@functools.lru_cache(maxsize=None)
+def _model_for_instruction(system_instruction: str):
+    return genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=system_instruction)
+
+def _get_model(system_instruction: Optional[str] = None):
+    """Returns the shared model, or the cached model bound to the given system instruction."""
+    if not system_instruction:
+        return _gemini_model
+    return _model_for_instruction(system_instruction)
+
+def warm_up(system_instructions: List[str]):
+    """
+    Builds the models for the given system instructions ahead of time (e.g. on app
+    startup), so the first request using each one doesn't pay for it.
+    """
+    for system_instruction in system_instructions:
+        _get_model(system_instruction)
+    logging.info(f"Gemini LLM: Warmed up {len(system_instructions)} system-instruction model(s).")
+
+# Cap on concurrent in-flight Gemini requests. Calls from concurrent transactions
+# overlap freely up to this limit; beyond it they queue instead of tripping the
+# provider's rate limits.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+_llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+async def _generate_content(system_instruction: Optional[str] = None, **kwargs):
+    """Sends one generate_content request once an in-flight slot is free."""
+    async with _llm_slots:
+        return await _get_model(system_instruction).generate_content_async(**kwargs)
+
+class _JsonObjectEndFinder:
+    """
+    Tracks brace depth across streamed text chunks (ignoring braces inside JSON strings)
+    to find where the first top-level JSON object closes.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> int:
+        """Returns the index in chunk just past the object's closing brace, or -1 if not closed yet."""
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                # Quotes only start a JSON string once inside the object; prose before it is ignored.
+                self.in_string = self.depth > 0
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1
+
+async def _stream_json_text(system_instruction: Optional[str] = None, **kwargs):
+    """
+    Streams a generate_content response and returns (text, response). Reading stops as
+    soon as the first top-level JSON object is complete, so trailing prose or markdown
+    the model adds after it is never waited for. The SDK has no public way to cancel a
+    stream, so the remainder is simply left unread. The in-flight slot is held while reading.
+    """
+    async with _llm_slots:
+        response = await _get_model(system_instruction).generate_content_async(stream=True, **kwargs)
+        finder = _JsonObjectEndFinder()
+        text_parts = []
+        async for chunk in response:
+            if not chunk.candidates:
+                continue
+            chunk_text = "".join(part.text for part in chunk.candidates[0].content.parts if hasattr(part, 'text'))
+            end_idx = finder.feed(chunk_text)
+            if end_idx != -1:
+                text_parts.append(chunk_text[:end_idx])
+                break
+            text_parts.append(chunk_text)
+        return "".join(text_parts), response
+
 # Initialize the model as soon as this module is imported.
 # It's crucial that `load_dotenv()` in `main_app.py` runs BEFORE this line.
 _initialize_gemini_model()
 
 
-async def call_gemini_for_classification(prompt_template: str, text_to_classify: str) -> str:
+async def call_gemini_for_classification(prompt_template: str, text_to_classify: str, system_instruction: Optional[str] = None) -> str:
     """
     Makes an asynchronous call to the Gemini API for classification.
     The function name is kept as 'call_ollama_for_classification' to avoid
@@ -48,6 +156,7 @@ async def call_gemini_for_classification(prompt_template: str, text_to_classify:
     Args:
         prompt_template (str): The prompt string with a placeholder for the text to classify.
         text_to_classify (str): The input text to be classified.
+        system_instruction (Optional[str]): Static instructions/examples sent as the model's system instruction.
         
     Returns:
         str: The classified intent (e.g., "Invoice", "Fraud Risk").
@@ -60,11 +169,14 @@ async def call_gemini_for_classification(prompt_template: str, text_to_classify:
         formatted_prompt = prompt_template.format(text_to_classify=text_to_classify)
 
         # Gemini models often perform best with content structured as a conversation.
-        response = await _gemini_model.generate_content_async(
+        response = await _generate_content(
+            system_instruction,
             contents=[{"role": "user", "parts": [{"text": formatted_prompt}]}],
             generation_config=genai.types.GenerationConfig(
                 temperature=0.0,      # Low temperature for deterministic classification
                 max_output_tokens=50, # Classification responses are typically short
+                response_mime_type="text/x.enum", # Constrain the answer to one of the intents
+                response_schema=CLASSIFICATION_RESPONSE_SCHEMA,
             ),
             safety_settings=[ # Recommended safety settings to allow broader responses
                 {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
@@ -96,8 +208,7 @@ async def call_gemini_for_classification(prompt_template: str, text_to_classify:
         intent = intent.split('\n')[0].strip() # Take only the first line
 
         # Validate the extracted intent against your predefined categories.
-        valid_llm_intents = ["RFQ", "Complaint", "Invoice", "Regulation", "Fraud Risk", "Other"]
-        if intent not in valid_llm_intents:
+        if intent not in VALID_LLM_INTENTS:
             logging.warning(f"LLM returned unrecognized intent '{intent}'. Defaulting to 'Other'. Full response: {intent}")
             return "Other"
 
@@ -114,7 +225,13 @@ async def call_gemini_for_classification(prompt_template: str, text_to_classify:
         return "LLM_Error"
 
 
-async def call_gemini_for_extraction(prompt_template: str, text_to_process: Optional[str] = None) -> Dict[str, Any]:
+async def call_gemini_for_extraction(
+    prompt_template: str,
+    text_to_process: Optional[str] = None,
+    system_instruction: Optional[str] = None,
+    response_schema: Optional[Dict[str, Any]] = None,
+    max_output_tokens: int = 1000
+) -> Dict[str, Any]:
     """
     Calls the Gemini API for structured data extraction and parses the JSON response.
     The function name is kept as 'call_ollama_for_extraction' to avoid
@@ -126,6 +243,11 @@ async def call_gemini_for_extraction(prompt_template: str, text_to_process: Opti
     Args:
         prompt_template (str): The prompt string, possibly with a placeholder.
         text_to_process (Optional[str]): The text to be processed and extracted from.
+        system_instruction (Optional[str]): Static instructions sent as the model's system instruction.
+        response_schema (Optional[Dict[str, Any]]): If given, Gemini's structured output mode is used
+            so the response is JSON conforming to this schema.
+        max_output_tokens (int): Output budget for the response. Callers whose answers are
+            known to be short should pass a tighter value than the default.
         
     Returns:
         Dict[str, Any]: The extracted data as a dictionary, or an error dictionary.
@@ -136,7 +258,7 @@ async def call_gemini_for_extraction(prompt_template: str, text_to_process: Opti
 
     try:
         # Determine the final prompt by formatting if a placeholder and text_to_process are present.
-        match_placeholder = re.search(r'\{(\w+)\}', prompt_template)
+        match_placeholder = _PLACEHOLDER_RE.search(prompt_template)
         
         if match_placeholder and text_to_process is not None:
             placeholder_name = match_placeholder.group(1)
@@ -144,12 +266,16 @@ async def call_gemini_for_extraction(prompt_template: str, text_to_process: Opti
         else:
             formatted_prompt = prompt_template
         
-        # Instruct Gemini to respond in JSON format directly within the prompt.
-        response = await _gemini_model.generate_content_async(
+        # Instruct Gemini to respond in JSON format, either via the prompt alone or,
+        # when a schema is given, via structured output mode.
+        structured_output = {"response_mime_type": "application/json", "response_schema": response_schema} if response_schema else {}
+        json_str_response, response = await _stream_json_text(
+            system_instruction,
             contents=[{"role": "user", "parts": [{"text": formatted_prompt}]}],
             generation_config=genai.types.GenerationConfig(
                 temperature=0.0,       # Low temperature for structured output
-                max_output_tokens=1000, # Allow sufficient tokens for JSON output
+                max_output_tokens=max_output_tokens,
+                **structured_output,
             ),
             safety_settings=[ # Recommended safety settings
                 {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
@@ -159,34 +285,34 @@ async def call_gemini_for_extraction(prompt_template: str, text_to_process: Opti
             ]
         )
 
-        json_str_response = ""
-        if response.candidates:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'text'):
-                    json_str_response = part.text
-                    break
-        else:
+        if not json_str_response and not response.candidates:
             if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
                 logging.warning(f"Gemini blocked response for extraction. Feedback: {response.prompt_feedback}")
             else:
                 logging.warning("Gemini returned no candidates for extraction.")
             return {"error": "LLM_Blocked"}
 
-        # Robust JSON parsing: Find the first '{' and last '}' to isolate the JSON.
-        # This handles cases where the LLM might include text before/after the JSON,
-        # or markdown code blocks like ```json{...}```.
+        # Robust JSON parsing: with structured output the response is plain JSON, so try the
+        # fast path first. Otherwise decode a single JSON value starting at the first '{'; this
+        # stops at the end of the object, so text or markdown fences (```json{...}```) before
+        # or after it are ignored without a second scan for the closing brace.
         start_idx = json_str_response.find('{')
-        end_idx = json_str_response.rfind('}')
-        
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            json_part = json_str_response[start_idx : end_idx + 1]
-            extracted_data = json.loads(json_part)
-        else:
-            # If no valid JSON object is found, return the raw response content as a dictionary.
+        if start_idx == -1:
+            # If no JSON object is found, return the raw response content as a dictionary.
             # This is useful for prompts that might just return a plain string (e.g., keyword lists).
             logging.warning(f"No valid JSON object found in LLM response for extraction. Returning raw response string. Response snippet: {json_str_response[:200]}...")
             return {"response": json_str_response.strip()}
 
+        try:
+            extracted_data = orjson.loads(json_str_response[start_idx:])
+        except orjson.JSONDecodeError:
+            try:
+                extracted_data, _ = _json_decoder.raw_decode(json_str_response, start_idx)
+            except json.JSONDecodeError as e:
+                # An object was started but is truncated (e.g. max_output_tokens hit) or malformed.
+                logging.error(f"Could not parse JSON object in LLM response for extraction: {e}. Response snippet: {json_str_response[:200]}...")
+                return {"error": str(e)}
+
         return extracted_data
 
     except genai.types.BlockedPromptException as e:
@@ -197,4 +323,55 @@ async def call_gemini_for_extraction(prompt_template: str, text_to_process: Opti
         return {"error": "Gemini_API_Error"}
     except Exception as e:
         logging.error(f"An unexpected error occurred during extraction call: {e}", exc_info=True)
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+
+async def call_gemini_for_batch_classification(prompt_template: str, texts: List[str], system_instruction: Optional[str] = None) -> Optional[List[str]]:
+    """
+    Classifies several texts with a single Gemini call.
+
+    The texts are numbered and substituted into the prompt's {texts_to_classify}
+    placeholder; the model is expected to answer with a JSON object mapping each
+    number to an intent, e.g. {"1": "Invoice", "2": "Other"}.
+
+    Args:
+        prompt_template (str): The batch prompt with a {texts_to_classify} placeholder.
+        texts (List[str]): The input texts to be classified.
+        system_instruction (Optional[str]): Static instructions/examples sent as the model's system instruction.
+
+    Returns:
+        Optional[List[str]]: One intent per input text, in order, or None if the
+        response could not be mapped back onto every text (callers should then
+        fall back to per-text classification).
+    """
+    numbered_texts = "\n\n".join(f"Text {i}:\n{text}" for i, text in enumerate(texts, start=1))
+    # One required, enum-constrained property per numbered text.
+    response_schema = {
+        "type": "OBJECT",
+        "properties": {str(i): CLASSIFICATION_RESPONSE_SCHEMA for i in range(1, len(texts) + 1)},
+        "required": [str(i) for i in range(1, len(texts) + 1)]
+    }
+    llm_result = await call_gemini_for_extraction(
+        prompt_template=prompt_template.format(texts_to_classify=numbered_texts),
+        text_to_process=None,
+        system_instruction=system_instruction,
+        response_schema=response_schema,
+        max_output_tokens=BATCH_CLASSIFICATION_TOKENS_PER_TEXT * len(texts) + 20 # {"n": "Intent"} per text plus braces
+    )
+
+    if llm_result.get("error") or "response" in llm_result:
+        logging.warning(f"Batch classification returned no usable JSON object: {llm_result}")
+        return None
+
+    intents = []
+    for i in range(1, len(texts) + 1):
+        intent = llm_result.get(str(i))
+        if not isinstance(intent, str):
+            logging.warning(f"Batch classification response is missing text {i}. Full response: {llm_result}")
+            return None
+        intent = intent.strip()
+        if intent not in VALID_LLM_INTENTS:
+            logging.warning(f"LLM returned unrecognized intent '{intent}' for text {i} in batch. Defaulting to 'Other'.")
+            intent = "Other"
+        intents.append(intent)
+    return intents
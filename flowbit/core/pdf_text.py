@@ -0,0 +1,42 @@
+# your_project_name/core/pdf_text.py
+
+import threading
+import fitz # PyMuPDF: 'pip install PyMuPDF'
+
+# PyMuPDF is not thread-safe: documents must not be opened or parsed from several
+# threads at once, even different documents. Every fitz call goes through this lock,
+# so concurrent worker threads (e.g. a PDF batch) extract one document at a time.
+_fitz_lock = threading.Lock()
+
+def extract_pdf_text(pdf_bytes: bytes, max_chars: int, skip_fontless: bool = False) -> str:
+    """
+    Extracts at most max_chars of page text with PyMuPDF, trimming the page that
+    fills the budget and never parsing later pages. Holds the fitz lock throughout.
+
+    Args:
+        pdf_bytes (bytes): The raw PDF document.
+        max_chars (int): Maximum number of characters to return.
+        skip_fontless (bool): Skip pages without any font resources (e.g. scanned
+            images), which cannot contain extractable text.
+
+    Returns:
+        str: The concatenated page text.
+    """
+    with _fitz_lock:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            page_texts = []
+            total_len = 0
+            for page in doc:
+                if skip_fontless and not page.get_fonts():
+                    continue
+                page_text = page.get_text("text")
+                remaining = max_chars - total_len
+                if len(page_text) >= remaining:
+                    page_texts.append(page_text[:remaining])
+                    break
+                page_texts.append(page_text)
+                total_len += len(page_text)
+        finally:
+            doc.close()
+    return "".join(page_texts)
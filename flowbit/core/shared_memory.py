@@ -1,10 +1,12 @@
 # your_project_name/core/shared_memory.py
 
-import redis
 import json
+import redis
+import msgpack # 'pip install msgpack'
 import os # Import os to access environment variables
+import dataclasses
 import logging # Import logging for better output management
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Union
 
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,7 +22,8 @@ _redis_client = None # Initialize as None
 
 try:
     # Attempt to connect to Redis
-    _redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
+    # Responses stay as bytes: msgpack values are binary and blobs pass through untouched
+    _redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=False)
     _redis_client.ping() # Test the connection
     logging.info(f"Shared Memory: Successfully connected to Redis at {REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
 except redis.exceptions.ConnectionError as e:
@@ -37,46 +40,201 @@ except Exception as e:
     raise Exception(f"Unexpected Redis connection error: {e}")
 
 
-def set_transaction_data(transaction_id: str, data: Dict[str, Any]):
+# Each transaction is stored as a Redis HASH (one msgpack-encoded value per top-level
+# field), so agents can write just the fields they change. The agent decision trace
+# is kept in its own Redis list next to it, so agents can append entries without
+# rewriting the whole history.
+TRACE_FIELD = "agent_decision_trace"
+
+def _trace_key(transaction_id: str) -> str:
+    return f"{transaction_id}:{TRACE_FIELD}"
+
+# Transactions written before the HASH layout are a single JSON string under the
+# transaction id. They are still readable (see _get_legacy_transaction_data) but are
+# treated as read-only: the write scripts below only touch keys that are hashes.
+
+# HSET only if the transaction already exists (as a hash), in a single atomic round trip.
+_HSET_IF_EXISTS_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    redis.call('HSET', KEYS[1], unpack(ARGV))
+    return 1
+end
+return 0
+"""
+_hset_if_exists = _redis_client.register_script(_HSET_IF_EXISTS_SCRIPT) if _redis_client else None
+
+# RPUSH trace entries only if the transaction (KEYS[1]) exists as a hash, in a single round trip.
+_RPUSH_IF_EXISTS_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    redis.call('RPUSH', KEYS[2], unpack(ARGV))
+    return 1
+end
+return 0
+"""
+_rpush_if_exists = _redis_client.register_script(_RPUSH_IF_EXISTS_SCRIPT) if _redis_client else None
+
+def _msgpack_default(obj: Any) -> Any:
+    """
+    Converts values msgpack can't encode natively (numpy values, dates, UUIDs,
+    pydantic models, dataclasses, sets) to plain types. Anything else is stored
+    as its str() rather than failing the whole write.
+    """
+    if hasattr(obj, "tolist"): # numpy arrays and scalars
+        return obj.tolist()
+    if hasattr(obj, "isoformat"): # datetime, date, time
+        return obj.isoformat()
+    if hasattr(obj, "model_dump"): # pydantic models
+        return obj.model_dump()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)}
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj) # UUID, Decimal, Path, ...
+
+def _dumps(value: Any) -> bytes:
+    """Serializes a value for Redis with msgpack (smaller and faster to parse than JSON)."""
+    return msgpack.packb(value, use_bin_type=True, default=_msgpack_default)
+
+def _loads(raw: bytes) -> Any:
+    """Deserializes a value written by _dumps."""
+    return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+def _split_fields(data: Union[Dict[str, Any], Any]):
+    """
+    Splits a transaction dict (or dataclass record) into msgpack-encoded hash fields
+    and the (optional) trace list.
+    """
+    if dataclasses.is_dataclass(data):
+        # Shallow read of the fields; dataclasses.asdict would deep-copy every value
+        data = {f.name: getattr(data, f.name) for f in dataclasses.fields(data)}
+    fields = {k: _dumps(v) for k, v in data.items() if k != TRACE_FIELD}
+    return fields, data.get(TRACE_FIELD)
+
+def _queue_trace_replace(pipe, transaction_id: str, trace: List[Dict[str, Any]]):
+    pipe.delete(_trace_key(transaction_id))
+    if trace:
+        pipe.rpush(_trace_key(transaction_id), *(_dumps(entry) for entry in trace))
+
+def set_transaction_data(transaction_id: str, data: Union[Dict[str, Any], Any]):
     """
     Stores or updates the entire transaction data object in Redis.
+    Accepts a dict or a dataclass record such as models.transaction.TxInit.
     """
     if _redis_client:
-        _redis_client.set(transaction_id, json.dumps(data))
+        fields, trace = _split_fields(data)
+        pipe = _redis_client.pipeline()
+        pipe.delete(transaction_id)
+        if fields:
+            pipe.hset(transaction_id, mapping=fields)
+        if trace is not None:
+            _queue_trace_replace(pipe, transaction_id, trace)
+        pipe.execute()
         logging.info(f"Shared Memory: Stored transaction {transaction_id}")
     else:
         logging.error(f"Shared Memory: Redis client not initialized. Cannot store transaction {transaction_id}.")
 
+def _is_hash(transaction_id: str) -> bool:
+    """True if the transaction exists in the current (HASH) layout."""
+    return _redis_client.type(transaction_id) == b"hash"
+
+def _get_legacy_transaction_data(transaction_id: str) -> Optional[Dict[str, Any]]:
+    """Reads a transaction stored in the pre-hash format (one JSON string under the id)."""
+    try:
+        data = _redis_client.get(transaction_id)
+        return json.loads(data) if data else None
+    except (redis.exceptions.ResponseError, json.JSONDecodeError) as e:
+        logging.error(f"Shared Memory: Failed to read legacy transaction {transaction_id}. Error: {e}")
+        return None
+
 def get_transaction_data(transaction_id: str) -> Optional[Dict[str, Any]]:
     """
     Retrieves the entire transaction data object from Redis.
     """
     if _redis_client:
-        data = _redis_client.get(transaction_id)
-        if data:
-            try:
-                return json.loads(data)
-            except json.JSONDecodeError as e:
-                logging.error(f"Shared Memory: Failed to decode JSON for transaction {transaction_id}. Error: {e}")
-                return None
-        return None
+        pipe = _redis_client.pipeline()
+        pipe.hgetall(transaction_id)
+        pipe.lrange(_trace_key(transaction_id), 0, -1)
+        try:
+            fields, trace = pipe.execute()
+        except redis.exceptions.ResponseError: # WRONGTYPE: stored in the legacy string format
+            return _get_legacy_transaction_data(transaction_id)
+        if not fields:
+            return None
+        try:
+            data = {k.decode(): _loads(v) for k, v in fields.items()}
+            data[TRACE_FIELD] = [_loads(entry) for entry in trace]
+            return data
+        except (ValueError, msgpack.UnpackException) as e:
+            logging.error(f"Shared Memory: Failed to decode msgpack for transaction {transaction_id}. Error: {e}")
+            return None
     else:
         logging.error(f"Shared Memory: Redis client not initialized. Cannot retrieve transaction {transaction_id}.")
         return None
 
+def append_decision_trace(transaction_id: str, entries: List[Dict[str, Any]]) -> bool:
+    """
+    Appends entries to a transaction's agent decision trace with a single atomic
+    RPUSH, without reading or rewriting the existing history.
+    """
+    if _redis_client:
+        if entries:
+            appended = _rpush_if_exists(keys=[transaction_id, _trace_key(transaction_id)], args=[_dumps(entry) for entry in entries])
+        else:
+            appended = _is_hash(transaction_id)
+        if not appended:
+            logging.warning(f"Shared Memory: Transaction {transaction_id} not found for trace append.")
+            return False
+        return True
+    else:
+        logging.error(f"Shared Memory: Redis client not initialized. Cannot append trace for {transaction_id}.")
+        return False
+
+# Blob name under which the classifier stores each transaction's original input bytes.
+RAW_INPUT_BLOB = "raw_input"
+
+def _blob_key(transaction_id: str, name: str) -> str:
+    return f"{transaction_id}:{name}"
+
+def set_transaction_blob(transaction_id: str, name: str, data: bytes):
+    """
+    Stores a raw binary payload for a transaction under its own key, so large
+    files are kept as bytes instead of being embedded in the transaction hash.
+    """
+    if _redis_client:
+        _redis_client.set(_blob_key(transaction_id, name), data)
+        logging.info(f"Shared Memory: Stored blob '{name}' ({len(data)} bytes) for transaction {transaction_id}")
+    else:
+        logging.error(f"Shared Memory: Redis client not initialized. Cannot store blob '{name}' for transaction {transaction_id}.")
+
+def get_transaction_blob(transaction_id: str, name: str) -> Optional[bytes]:
+    """
+    Retrieves a raw binary payload stored with set_transaction_blob.
+    """
+    if _redis_client:
+        return _redis_client.get(_blob_key(transaction_id, name))
+    else:
+        logging.error(f"Shared Memory: Redis client not initialized. Cannot retrieve blob '{name}' for transaction {transaction_id}.")
+        return None
+
 def update_transaction_data(transaction_id: str, new_data_fields: Dict[str, Any]):
     """
     Updates specific fields within an existing transaction data object in Redis.
-    This reads, merges, then writes back.
+    Only the given fields are written (HSET); the rest of the transaction is untouched.
     """
     if _redis_client:
-        current_data = get_transaction_data(transaction_id)
-        if current_data:
-            # Merge new fields into current data
-            # This performs a shallow merge. For deep merges of nested dicts,
-            # a more complex merge logic would be needed.
-            current_data.update(new_data_fields)
-            set_transaction_data(transaction_id, current_data)
+        # This performs a shallow merge: each top-level field is replaced as a whole.
+        fields, trace = _split_fields(new_data_fields)
+        updated = True
+        if fields:
+            updated = bool(_hset_if_exists(keys=[transaction_id], args=[item for pair in fields.items() for item in pair]))
+        elif not _is_hash(transaction_id):
+            updated = False
+        if updated:
+            if trace is not None:
+                # The trace list is only rewritten if new_data_fields replaces it.
+                pipe = _redis_client.pipeline()
+                _queue_trace_replace(pipe, transaction_id, trace)
+                pipe.execute()
             logging.info(f"Shared Memory: Updated transaction {transaction_id}")
             return True
         else:
@@ -85,15 +243,3 @@ def update_transaction_data(transaction_id: str, new_data_fields: Dict[str, Any]
     else:
         logging.error(f"Shared Memory: Redis client not initialized. Cannot update transaction {transaction_id}.")
         return False
-
-# You might add more specific functions like:
-# def append_to_trace(transaction_id: str, trace_entry: Dict[str, Any]):
-#     if _redis_client:
-#         data = get_transaction_data(transaction_id)
-#         if data and "agent_decision_trace" in data:
-#             data["agent_decision_trace"].append(trace_entry)
-#             set_transaction_data(transaction_id, data)
-#         else:
-#             logging.error(f"Error: Could not append trace for {transaction_id} (data or trace field missing).")
-#     else:
-#         logging.error(f"Shared Memory: Redis client not initialized. Cannot append trace for {transaction_id}.")
\ No newline at end of file
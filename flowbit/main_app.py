@@ -3,13 +3,24 @@
 from dotenv import load_dotenv
 load_dotenv() # This loads variables from .env
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from typing import Optional
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
+from fastapi.responses import ORJSONResponse, Response
+from typing import Any, Dict, Optional
 from datetime import datetime
-import json
+import os
+import time
 import uuid
+import queue
+import hashlib
+import asyncio
+import logging
+import anyio
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 # Import core utilities and agents
 from .core import shared_memory
@@ -19,8 +30,61 @@ from .agents import classifier_agent
 from .agents import email_agent
 from .agents import json_agent
 from .agents import pdf_agent # UNCOMMENT THIS LINE
+from .models.transaction import TxInit
 
-app = FastAPI()
+# --- Logging ---
+# Records from the "flowbit" package loggers (this module, agents, action router) are
+# put on an in-memory queue and written to stderr by a background listener thread,
+# so request handlers never block the event loop on console writes.
+_log_queue: queue.Queue = queue.Queue(-1)
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_listener = QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+
+logger = logging.getLogger("flowbit")
+logger.addHandler(QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False # Already written by the listener; don't also write via the root handler
+
+log = logging.getLogger(__name__)
+
+# orjson serializes response bodies instead of stdlib json
+app = FastAPI(default_response_class=ORJSONResponse)
+
+def _orjson_default(obj: Any) -> Any:
+    """Handles values orjson doesn't serialize natively (datetime and UUID already are)."""
+    if isinstance(obj, bytes): # msgpack bin values from shared memory
+        return obj.decode("utf-8", errors="replace")
+    if hasattr(obj, "tolist"): # numpy values OPT_SERIALIZE_NUMPY doesn't cover
+        return obj.tolist()
+    return str(obj) # Audit output should never fail on an unexpected type
+
+def _dumps_pretty(obj: Any) -> str:
+    """Pretty-prints a value as indented JSON text (used for human-readable alert details)."""
+    return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+
+def _dumps_json(payload: Any) -> bytes:
+    """Serializes a response payload to JSON bytes with orjson."""
+    return orjson.dumps(payload, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+def _json_response(payload: Any) -> Response:
+    """
+    Serializes the payload with orjson into a ready-made Response, so FastAPI skips
+    jsonable_encoder on large, deeply nested transaction documents.
+    """
+    return Response(content=_dumps_json(payload), media_type="application/json")
+
+def _ns_to_iso(timestamp_ns: int) -> str:
+    """Renders an epoch-nanosecond timestamp as a local ISO 8601 string."""
+    return datetime.fromtimestamp(timestamp_ns / 1e9).isoformat()
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Checks an If-None-Match header value against an ETag (weak comparison, as for GET)."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
 
 # --- NEW: Configure CORS middleware ---
 # This allows your Streamlit app (or any origin) to make requests
@@ -40,16 +104,171 @@ app.add_middleware(
 )
 # --- END NEW CORS CONFIG ---
 
+# Compress larger responses (audit traces are verbose JSON) for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Worker threads for CPU-bound agent work (PDF text extraction, large JSON parsing and
+# validation). Installed as the event loop's default executor, so every asyncio.to_thread
+# call in the agents shares this bounded pool.
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", os.cpu_count() or 4))
+
+# Size of AnyIO's worker-thread limiter, which FastAPI uses for sync endpoints and
+# dependencies and Starlette uses for UploadFile I/O (AnyIO's default is 40).
+FLOWBIT_THREADPOOL = int(os.getenv("FLOWBIT_THREADPOOL", 32))
+
+@app.on_event("startup")
+async def startup_event():
+    app.state.cpu_executor = ThreadPoolExecutor(max_workers=CPU_POOL_WORKERS, thread_name_prefix="flowbit-cpu")
+    asyncio.get_running_loop().set_default_executor(app.state.cpu_executor)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = FLOWBIT_THREADPOOL
+    # Build the per-system-instruction Gemini models before the first request needs them
+    llm_client.warm_up([
+        classifier_agent.CLASSIFIER_SYSTEM_INSTRUCTION,
+        *([classifier_agent.BATCH_CLASSIFIER_SYSTEM_INSTRUCTION] if classifier_agent.LLM_BATCH_ENABLED else []),
+        email_agent.EMAIL_EXTRACTION_SYSTEM_INSTRUCTION
+    ])
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Release the Action Router's pooled HTTP connections
+    await action_router.close_client()
+    app.state.cpu_executor.shutdown(wait=False)
+    # Flush any queued log records
+    _log_listener.stop()
+
 # --- Shared Memory Audit Endpoint ---
 @app.get("/audit/{transaction_id}")
-async def audit_trace(transaction_id: str):
+async def audit_trace(transaction_id: str, request: Request) -> Response:
     """
     Retrieves the full audit trace for a given transaction ID from shared memory.
+    The document is serialized straight to bytes with orjson; there is no response
+    model, so Pydantic validation and jsonable_encoder are intentionally skipped.
+    Responses carry an ETag of the body, and a matching If-None-Match gets a 304.
     """
     trace = shared_memory.get_transaction_data(transaction_id)
     if not trace:
         raise HTTPException(status_code=404, detail="Transaction ID not found")
-    return trace
+
+    if isinstance(trace.get("timestamp"), int):
+        trace["timestamp"] = _ns_to_iso(trace["timestamp"])
+
+    body = _dumps_json(trace)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=5"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# --- Chained Action Handlers ---
+# One handler per chained action an agent can propose. Each receives the final
+# transaction data and may return a replacement for the response's next_step message.
+
+def _email_fields(tx: Dict[str, Any]):
+    """Returns (sender, issue_request, tone) as extracted by the Email agent."""
+    extracted_data = tx.get("extracted_data") or {}
+    return extracted_data.get("sender", "N/A"), extracted_data.get("issue_request", "N/A"), extracted_data.get("tone", "N/A")
+
+async def _handle_escalate_crm(tx: Dict[str, Any], detected_format: str, detected_intent: str) -> Optional[str]:
+    sender, issue_request, tone = _email_fields(tx)
+    await action_router.trigger_action(
+        tx["transaction_id"],
+        "CRM_Escalate", # Matches string in action_router
+        {"sender": sender, "issue_request": issue_request, "tone": tone, "source_intent": detected_intent}
+    )
+
+async def _handle_log_and_close_crm(tx: Dict[str, Any], detected_format: str, detected_intent: str) -> Optional[str]:
+    sender, issue_request, _ = _email_fields(tx)
+    await action_router.trigger_action(
+        tx["transaction_id"],
+        "CRM_LogAndClose", # Matches string in action_router
+        {"sender": sender, "issue_request": issue_request, "source_intent": detected_intent}
+    )
+
+async def _handle_log_alert(tx: Dict[str, Any], detected_format: str, detected_intent: str) -> Optional[str]:
+    # Data for risk alert comes from anomaly_details/flagged_conditions
+    anomaly_details = tx.get("anomaly_details", [])
+    flagged_conditions = tx.get("flagged_conditions", [])
+
+    alert_type = f"{detected_format.upper()}_ANOMALY" if anomaly_details else f"{detected_format.upper()}_FLAG"
+
+    # Consolidate all relevant information for the alert, leaving out values that are None
+    details_for_alert = {"anomalies": anomaly_details, "flags": flagged_conditions}
+    if detected_intent is not None:
+        details_for_alert["intent"] = detected_intent
+    details_for_alert["source_format"] = detected_format
+    if (extracted_data := tx.get("extracted_data")) is not None: # From Email/JSON agent
+        details_for_alert["extracted_data"] = extracted_data
+    if (pdf_agent_output := tx.get("pdf_agent_output")) is not None: # From PDF agent
+        details_for_alert["pdf_agent_output"] = pdf_agent_output
+    if (raw_input_preview := tx.get("initial_input_preview")) is not None: # From Classifier
+        details_for_alert["raw_input_preview"] = raw_input_preview
+
+    await action_router.trigger_action(
+        tx["transaction_id"],
+        "Risk_Alert", # Matches string in action_router
+        {"alert_type": alert_type, "details": _dumps_pretty(details_for_alert), "source": detected_format, "intent": detected_intent}
+    )
+
+async def _handle_escalate_crm_and_risk_alert(tx: Dict[str, Any], detected_format: str, detected_intent: str) -> Optional[str]:
+    sender, issue_request, tone = _email_fields(tx)
+    # The two actions are independent, so dispatch them concurrently
+    await asyncio.gather(
+        action_router.trigger_action(
+            tx["transaction_id"],
+            "CRM_Escalate",
+            {"sender": sender, "issue_request": issue_request, "tone": tone, "source_intent": detected_intent}
+        ),
+        action_router.trigger_action(
+            tx["transaction_id"],
+            "Risk_Alert",
+            {"alert_type": "THREATENING_EMAIL", "details": f"Threatening email from {sender} regarding: {issue_request}", "source": detected_format, "intent": detected_intent}
+        )
+    )
+
+async def _handle_log_error(tx: Dict[str, Any], detected_format: str, detected_intent: str) -> Optional[str]:
+    # Handles generic errors from agents
+    error_message = tx.get("error_message", "Unknown error during agent processing.")
+    # Also include any available extracted/flagged data for context, leaving out values that are None
+    details_for_alert = {}
+    if error_message is not None:
+        details_for_alert["error_message"] = error_message
+    details_for_alert["source_format"] = detected_format
+    if detected_intent is not None:
+        details_for_alert["source_intent"] = detected_intent
+    if (agent_output := tx.get("extracted_data") or tx.get("pdf_agent_output")) is not None:
+        details_for_alert["agent_output"] = agent_output
+    if (flagged_conditions := tx.get("flagged_conditions", [])) is not None: # Ensure this is also passed
+        details_for_alert["flagged_conditions"] = flagged_conditions
+    await action_router.trigger_action(
+        tx["transaction_id"],
+        "Risk_Alert", # Log all errors as risk alerts for review
+        {"alert_type": f"{detected_format.upper()}_PROCESSING_ERROR", "details": _dumps_pretty(details_for_alert), "source": detected_format, "intent": detected_intent}
+    )
+
+async def _handle_none(tx: Dict[str, Any], detected_format: str, detected_intent: str) -> Optional[str]:
+    log.info("Action Router: No specific chained action for transaction %s.", tx['transaction_id'])
+    return "Classification and processing complete. No chained action triggered."
+
+async def _handle_unrecognized(tx: Dict[str, Any], detected_format: str, detected_intent: str) -> Optional[str]:
+    # Fallback for any unhandled chained_action values from agents
+    chained_action = tx.get("chained_action_triggered")
+    log.warning("Action Router: Unrecognized chained action from agent: %s for transaction %s.", chained_action, tx['transaction_id'])
+    await action_router.trigger_action(
+        tx["transaction_id"],
+        "Risk_Alert", # Log as a system alert
+        {"alert_type": "UNRECOGNIZED_CHAINED_ACTION", "details": f"Agent proposed '{chained_action}' for intent '{detected_intent}'.", "source": "System"}
+    )
+    return f"Processing complete, but agent proposed unrecognized action: {chained_action}."
+
+# Chained action proposed by an agent -> handler. Anything else goes to _handle_unrecognized.
+_CHAINED_DISPATCH = {
+    "escalate_crm": _handle_escalate_crm,
+    "log_and_close_crm": _handle_log_and_close_crm,
+    "Log Alert": _handle_log_alert,
+    "escalate_crm_and_risk_alert": _handle_escalate_crm_and_risk_alert,
+    "Log Error": _handle_log_error,
+    "None": _handle_none,
+}
 
 # --- Classifier Agent Endpoint ---
 @app.post("/")
@@ -61,17 +280,18 @@ async def classify_input(
     Receives input (file or text), detects format and business intent using LLM,
     stores metadata in shared memory, and triggers the next appropriate agent.
     """
-    transaction_id = str(uuid.uuid4())
-    current_timestamp = datetime.now().isoformat()
+    # 32-char hex ids keep Redis keys short; timestamps are stored as epoch nanoseconds
+    # and only rendered as ISO 8601 when an audit trace is returned.
+    transaction_id = uuid.uuid4().hex
+    current_timestamp = time.time_ns()
     
     # Initialize transaction data in shared memory early to ensure trace starts
-    shared_memory.set_transaction_data(transaction_id, {
-        "transaction_id": transaction_id,
-        "timestamp": current_timestamp,
-        "raw_input_type": "file" if file else "text",
-        "initial_input_preview": (file.filename if file else text_input[:100]) if (file or text_input) else "No input provided",
-        "agent_decision_trace": [] # Initialize trace list
-    })
+    shared_memory.set_transaction_data(transaction_id, TxInit(
+        transaction_id=transaction_id,
+        timestamp=current_timestamp,
+        raw_input_type="file" if file else "text",
+        initial_input_preview=(file.filename if file else text_input[:100]) if (file or text_input) else "No input provided"
+    ))
 
     try:
         # Perform initial classification using the Classifier Agent logic
@@ -86,8 +306,8 @@ async def classify_input(
         detected_intent = classification_result.get("intent")
 
         # --- Routing Logic ---
-        print(f"Classifier Agent: Transaction {transaction_id} - Format: {detected_format}, Intent: {detected_intent}")
-        print(f"Routing to {detected_format} Agent...")
+        log.info("Classifier Agent: Transaction %s - Format: %s, Intent: %s", transaction_id, detected_format, detected_intent)
+        log.info("Routing to %s Agent...", detected_format)
 
         next_step_message = f"Processing by {detected_format} Agent..."
         
@@ -100,12 +320,11 @@ async def classify_input(
            next_step_message = f"Routed to {detected_format} Agent (processing complete)."
         else:
             next_step_message = f"No specific agent for format '{detected_format}' or agent not yet implemented. Classification complete."
-            # For unhandled formats, we might still want a basic log
-            current_data = shared_memory.get_transaction_data(transaction_id)
-            if current_data:
-                current_data["final_status"] = "completed_no_specific_agent"
-                current_data["agent_processed_by"] = "ClassifierAgent"
-                shared_memory.set_transaction_data(transaction_id, current_data)
+            # For unhandled formats, we might still want a basic log (only these fields are written)
+            shared_memory.update_transaction_data(transaction_id, {
+                "final_status": "completed_no_specific_agent",
+                "agent_processed_by": "ClassifierAgent"
+            })
 
 
         # After the specific agent processes, it updates the shared memory.
@@ -113,143 +332,55 @@ async def classify_input(
         final_transaction_data = shared_memory.get_transaction_data(transaction_id)
         if final_transaction_data:
             chained_action = final_transaction_data.get("chained_action_triggered")
-            print(f"Main App: Chained action from agent for {transaction_id}: {chained_action}")
-
-            # Define proposed_action strings for action_router to match
-            if chained_action == "escalate_crm":
-                # Ensure data matches what crm/escalate expects
-                sender = final_transaction_data.get("extracted_data", {}).get("sender", "N/A")
-                issue_request = final_transaction_data.get("extracted_data", {}).get("issue_request", "N/A")
-                tone = final_transaction_data.get("extracted_data", {}).get("tone", "N/A")
-                await action_router.trigger_action(
-                    transaction_id,
-                    "CRM_Escalate", # Matches string in action_router
-                    {"sender": sender, "issue_request": issue_request, "tone": tone, "source_intent": detected_intent}
-                )
-            elif chained_action == "log_and_close_crm":
-                # Ensure data matches what crm/log_and_close expects
-                sender = final_transaction_data.get("extracted_data", {}).get("sender", "N/A")
-                issue_request = final_transaction_data.get("extracted_data", {}).get("issue_request", "N/A")
-                await action_router.trigger_action(
-                    transaction_id,
-                    "CRM_LogAndClose", # Matches string in action_router
-                    {"sender": sender, "issue_request": issue_request, "source_intent": detected_intent}
-                )
-            elif chained_action == "Log Alert":
-                # Data for risk alert comes from anomaly_details/flagged_conditions
-                anomaly_details = final_transaction_data.get("anomaly_details", [])
-                flagged_conditions = final_transaction_data.get("flagged_conditions", [])
-                
-                alert_type = f"{detected_format.upper()}_ANOMALY" if anomaly_details else f"{detected_format.upper()}_FLAG"
-                
-                # Consolidate all relevant information for the alert
-                details_for_alert = {
-                    "anomalies": anomaly_details,
-                    "flags": flagged_conditions,
-                    "intent": detected_intent,
-                    "source_format": detected_format,
-                    "extracted_data": final_transaction_data.get("extracted_data"), # From Email/JSON agent
-                    "pdf_agent_output": final_transaction_data.get("pdf_agent_output"), # From PDF agent
-                    "raw_input_preview": final_transaction_data.get("initial_input_preview") # From Classifier
-                }
-                # Clean up None values before serializing
-                details_for_alert = {k: v for k, v in details_for_alert.items() if v is not None}
-
-                await action_router.trigger_action(
-                    transaction_id,
-                    "Risk_Alert", # Matches string in action_router
-                    {"alert_type": alert_type, "details": json.dumps(details_for_alert, indent=2), "source": detected_format, "intent": detected_intent}
-                )
-            elif chained_action == "escalate_crm_and_risk_alert":
-                # Trigger both CRM_Escalate and Risk_Alert
-                sender = final_transaction_data.get("extracted_data", {}).get("sender", "N/A")
-                issue_request = final_transaction_data.get("extracted_data", {}).get("issue_request", "N/A")
-                tone = final_transaction_data.get("extracted_data", {}).get("tone", "N/A")
-                
-                await action_router.trigger_action(
-                    transaction_id,
-                    "CRM_Escalate",
-                    {"sender": sender, "issue_request": issue_request, "tone": tone, "source_intent": detected_intent}
-                )
-                await action_router.trigger_action(
-                    transaction_id,
-                    "Risk_Alert",
-                    {"alert_type": "THREATENING_EMAIL", "details": f"Threatening email from {sender} regarding: {issue_request}", "source": detected_format, "intent": detected_intent}
-                )
-            elif chained_action == "Log Error": # Handles generic errors from agents
-                error_message = final_transaction_data.get("error_message", "Unknown error during agent processing.")
-                # Also include any available extracted/flagged data for context
-                details_for_alert = {
-                    "error_message": error_message,
-                    "source_format": detected_format,
-                    "source_intent": detected_intent,
-                    "agent_output": final_transaction_data.get("extracted_data") or final_transaction_data.get("pdf_agent_output"),
-                    "flagged_conditions": final_transaction_data.get("flagged_conditions", []) # Ensure this is also passed
-                }
-                details_for_alert = {k: v for k, v in details_for_alert.items() if v is not None} # Clean up None values
-                await action_router.trigger_action(
-                    transaction_id,
-                    "Risk_Alert", # Log all errors as risk alerts for review
-                    {"alert_type": f"{detected_format.upper()}_PROCESSING_ERROR", "details": json.dumps(details_for_alert, indent=2), "source": detected_format, "intent": detected_intent}
-                )
-            elif chained_action == "None":
-                print(f"Action Router: No specific chained action for transaction {transaction_id}.")
-                next_step_message = "Classification and processing complete. No chained action triggered."
-            else:
-                # Fallback for any unhandled chained_action values from agents
-                print(f"Action Router: Unrecognized chained action from agent: {chained_action} for transaction {transaction_id}.")
-                next_step_message = f"Processing complete, but agent proposed unrecognized action: {chained_action}."
-                await action_router.trigger_action(
-                    transaction_id,
-                    "Risk_Alert", # Log as a system alert
-                    {"alert_type": "UNRECOGNIZED_CHAINED_ACTION", "details": f"Agent proposed '{chained_action}' for intent '{detected_intent}'.", "source": "System"}
-                )
+            log.info("Main App: Chained action from agent for %s: %s", transaction_id, chained_action)
+
+            handler = _CHAINED_DISPATCH.get(chained_action, _handle_unrecognized)
+            next_step_message = await handler(final_transaction_data, detected_format, detected_intent) or next_step_message
         else:
-            print(f"Action Router: Could not retrieve final transaction data for {transaction_id}.")
+            log.error("Action Router: Could not retrieve final transaction data for %s.", transaction_id)
             next_step_message = "Processing completed, but final transaction data retrieval failed for action routing."
 
-        return {
+        return _json_response({
             "message": "Input classified and metadata stored.",
             "transaction_id": transaction_id,
             "format": detected_format,
             "intent": detected_intent,
             "next_step": next_step_message
-        }
+        })
     except HTTPException as e:
-        # Update trace for HTTP exceptions if they occur before final trace update
-        current_data = shared_memory.get_transaction_data(transaction_id)
-        if current_data:
-            current_data["final_status"] = "error"
-            current_data["error_message"] = f"HTTP Error in main routing: {e.detail}"
-            current_data["agent_decision_trace"].append({"agent": "main_router", "step": "http_exception", "details": str(e.detail)})
-            shared_memory.set_transaction_data(transaction_id, current_data)
+        # Update trace for HTTP exceptions if they occur before final trace update.
+        # Only the error fields and the new trace entry are written; nothing is read back.
+        if shared_memory.update_transaction_data(transaction_id, {
+            "final_status": "error",
+            "error_message": f"HTTP Error in main routing: {e.detail}"
+        }):
+            shared_memory.append_decision_trace(transaction_id, [{"agent": "main_router", "step": "http_exception", "details": str(e.detail)}])
         raise e # Re-raise FastAPI HTTP exceptions
     except Exception as e:
-        print(f"An unexpected error occurred in /classify: {e}")
+        log.error("An unexpected error occurred in /classify: %s", e, exc_info=True)
         # Ensure error is logged to shared memory even if an unexpected exception occurs here
-        current_data = shared_memory.get_transaction_data(transaction_id)
-        if current_data:
-            current_data["final_status"] = "error"
-            current_data["error_message"] = f"Critical error in main routing: {str(e)}"
-            current_data["agent_decision_trace"].append({"agent": "main_router", "step": "critical_error", "details": str(e)})
-            shared_memory.set_transaction_data(transaction_id, current_data)
+        if shared_memory.update_transaction_data(transaction_id, {
+            "final_status": "error",
+            "error_message": f"Critical error in main routing: {str(e)}"
+        }):
+            shared_memory.append_decision_trace(transaction_id, [{"agent": "main_router", "step": "critical_error", "details": str(e)}])
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
 # --- Simulated External Service Endpoints (for Action Router) ---
 @app.post("/crm/escalate")
 async def crm_escalate_endpoint(data: dict):
-    print(f"CRM: Escalating issue for {data.get('sender', 'N/A')}: {data.get('issue_request', 'N/A')}. Tone: {data.get('tone', 'N/A')}")
+    log.info("CRM: Escalating issue for %s: %s. Tone: %s", data.get('sender', 'N/A'), data.get('issue_request', 'N/A'), data.get('tone', 'N/A'))
     # In a real scenario, this would interact with a CRM API
     return {"status": "success", "message": "Issue escalated in CRM"}
 
 @app.post("/crm/log_and_close")
 async def crm_log_and_close_endpoint(data: dict):
-    print(f"CRM: Logging and closing issue for {data.get('sender', 'N/A')}: {data.get('issue_request', 'N/A')}")
+    log.info("CRM: Logging and closing issue for %s: %s", data.get('sender', 'N/A'), data.get('issue_request', 'N/A'))
     # In a real scenario, this would interact with a CRM API
     return {"status": "success", "message": "Issue logged and closed in CRM"}
 
 @app.post("/risk_alert")
 async def risk_alert_endpoint(data: dict):
-    print(f"RISK: New alert: {data.get('alert_type', 'N/A')} - Details: {data.get('details', 'N/A')}. Source: {data.get('source', 'N/A')}. Intent: {data.get('intent', 'N/A')}")
+    log.info("RISK: New alert: %s - Details: %s. Source: %s. Intent: %s", data.get('alert_type', 'N/A'), data.get('details', 'N/A'), data.get('source', 'N/A'), data.get('intent', 'N/A'))
     # In a real scenario, this would interact with a risk management system
     return {"status": "success", "message": "Risk alert triggered"}
\ No newline at end of file
@@ -0,0 +1,18 @@
+# your_project_name/models/transaction.py
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+
+@dataclass(slots=True)
+class TxInit:
+    """
+    The initial record written for every transaction before classification.
+    A fixed-shape struct instead of a dict literal; shared_memory turns it into
+    hash fields only when it is stored.
+    """
+    transaction_id: str
+    timestamp: int # Epoch nanoseconds
+    raw_input_type: str
+    initial_input_preview: str
+    agent_decision_trace: List[Dict[str, Any]] = field(default_factory=list)
@@ -3,6 +3,7 @@
 import streamlit as st
 import requests
 import json
+import orjson
 import os # <-- NEW: Import the os module
 
 # FastAPI backend URL
@@ -11,6 +12,23 @@ FASTAPI_URL = os.getenv("FASTAPI_BACKEND_URL", "http://localhost:8000")
 
 st.set_page_config(layout="centered", page_title="AI Multi-Format Classifier")
 
+# --- JSON display ---
+# Large objects are pre-rendered with orjson and shown as a plain code block, which is
+# far lighter for the browser than st.json's interactive viewer on long audit traces.
+def _show_json(obj):
+    st.code(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode(), language="json")
+
+# --- Shared HTTP session ---
+# Cached across Streamlit reruns so requests reuse pooled keep-alive connections
+# to the backend instead of opening a new connection per click.
+@st.cache_resource
+def _session() -> requests.Session:
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 st.title("AI Multi-Format Classifier 🤖")
 st.markdown("Upload a file (Email, JSON, PDF) or enter text to classify its format and business intent.")
 
@@ -58,12 +76,12 @@ if classification_button:
                 files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
                 st.write(f"Sending file: {uploaded_file.name} ({uploaded_file.type}) to **{FASTAPI_URL}/**") # Added for debug
                 # --- UPDATED: POST to root path / ---
-                response = requests.post(f"{FASTAPI_URL}/", files=files)
+                response = _session().post(f"{FASTAPI_URL}/", files=files)
             elif text_input:
                 data = {"text_input": text_input}
                 st.write(f"Sending text input to **{FASTAPI_URL}/**") # Added for debug
                 # --- UPDATED: POST to root path / ---
-                response = requests.post(f"{FASTAPI_URL}/", data=data)
+                response = _session().post(f"{FASTAPI_URL}/", data=data)
 
             response.raise_for_status() # Raise an exception for HTTP errors
             response_data = response.json()
@@ -78,7 +96,7 @@ if classification_button:
             st.error(f"Error during classification: {e}. Check the backend logs for details.")
             if 'response' in locals() and response.text:
                 try:
-                    st.json(response.json()) # Try to show FastAPI's error response
+                    _show_json(response.json()) # Try to show FastAPI's error response
                 except json.JSONDecodeError:
                     st.code(response.text) # Show raw text if not JSON
 
@@ -86,7 +104,7 @@ if classification_button:
 if st.session_state.classification_result:
     response_data = st.session_state.classification_result
     st.success("Classification Complete!")
-    st.json(response_data) # Display raw response for debugging
+    _show_json(response_data) # Display raw response for debugging
 
     # Display key results clearly
     st.subheader("Classification Results:")
@@ -100,15 +118,33 @@ if st.session_state.classification_result:
         if st.button("View Full Audit Trace in Memory"):
             try:
                 # The /audit/{transaction_id} endpoint path remains the same
-                audit_response = requests.get(f"{FASTAPI_URL}/audit/{st.session_state.transaction_id}")
+                # Revalidate with the ETag of the last trace fetched for this transaction;
+                # a 304 means it hasn't changed and the cached copy is shown.
+                cached_audit = st.session_state.get('audit_cache')
+                headers = {}
+                if cached_audit and cached_audit["transaction_id"] == st.session_state.transaction_id:
+                    headers["If-None-Match"] = cached_audit["etag"]
+                audit_response = _session().get(f"{FASTAPI_URL}/audit/{st.session_state.transaction_id}", headers=headers)
                 audit_response.raise_for_status()
-                st.json(audit_response.json())
+                if audit_response.status_code == 304:
+                    audit_trace = cached_audit["trace"]
+                else:
+                    audit_trace = orjson.loads(audit_response.content)
+                    if audit_response.headers.get("ETag"):
+                        st.session_state.audit_cache = {
+                            "transaction_id": st.session_state.transaction_id,
+                            "etag": audit_response.headers["ETag"],
+                            "trace": audit_trace
+                        }
+                # Collapsed by default; the trace is only laid out when expanded
+                with st.expander("Audit trace", expanded=False):
+                    _show_json(audit_trace)
             except requests.exceptions.ConnectionError:
                 st.error(f"Could not connect to FastAPI server at `{FASTAPI_URL}` to fetch audit. Is it running?")
             except requests.exceptions.RequestException as e:
                 st.error(f"Error fetching audit trace: {e}. Check the backend logs.")
                 if 'audit_response' in locals() and audit_response.text:
                     try:
-                        st.json(audit_response.json())
+                        _show_json(audit_response.json())
                     except json.JSONDecodeError:
                         st.code(audit_response.text)
\ No newline at end of file